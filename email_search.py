@@ -1,10 +1,149 @@
 import imaplib
-import email
 from email.header import decode_header
+from email.feedparser import BytesFeedParser
+from email.utils import getaddresses
+import functools
 import getpass
 import os
 import json
-from typing import List, Optional, Dict
+import queue
+import re
+import ssl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+# メッセージID先頭の YYYYMMDDhhmmss (例: 20240213212126.4429A161827048B0@gmail.com)
+_MID_TS_RE = re.compile(r"^(\d{14})[.\-@]")
+
+# LIST 応答: (フラグ) "区切り文字" 名前（名前はクォート・アトム・リテラルのいずれか）
+_LIST_RE = re.compile(
+    rb'^\((?P<flags>[^)]*)\)\s+(?:"(?:[^"\\]|\\.)*"|NIL)\s+'
+    rb'(?:"(?P<qname>(?:[^"\\]|\\.)*)"|(?P<literal>\{\d+\})|(?P<name>\S+))$',
+    re.I,
+)
+_LIST_SKIP_FLAGS = (b"\\noselect", b"\\nonexistent")
+
+# quoted string 内のエスケープ (\\ と \")
+_QUOTED_PAIR_RE = re.compile(r"\\(.)")
+
+# STATUS 応答: 名前 (項目 値 ...)
+_STATUS_RE = re.compile(
+    r'^(?:"(?P<qname>(?:[^"\\]|\\.)*)"|(?P<name>[^\s(]+))\s+\((?P<items>[^)]*)\)',
+)
+_STATUS_MESSAGES_RE = re.compile(r"\bMESSAGES (\d+)", re.I)
+
+# ヘッダー行 (折り返しの継続行を含む) と、折り返しの改行
+_HEADER_LINE_RE = re.compile(rb"^([!-9;-~]+):[ \t]*(.*(?:\r?\n[ \t].*)*)", re.M)
+_HEADER_FOLD_RE = re.compile(rb"\r?\n(?=[ \t])")
+
+# Message-ID ヘッダーの値: < > の中を優先し、無ければ (コメント) 以外の最初の語
+_MID_BRACKET_RE = re.compile(r"<\s*([^<>\s]+)\s*>")
+_MID_COMMENT_RE = re.compile(r"\([^()]*\)")
+_MID_TOKEN_RE = re.compile(r"[^<>()\s]+")
+
+# ESEARCH (RFC 4731) 応答の MIN / MAX / COUNT
+_ESEARCH_RE = re.compile(rb"\b(MIN|MAX|COUNT) (\d+)", re.I)
+
+# MULTISEARCH (RFC 7377) の ESEARCH 応答: どのメールボックスの結果か と UID の一覧
+_MULTISEARCH_RE = re.compile(
+    rb'\(TAG "[^"]*" MAILBOX (?:"(?P<qname>(?:[^"\\]|\\.)*)"|(?P<name>[^\s{)]+)) '
+    rb'UIDVALIDITY (?P<uidvalidity>\d+)\).*?\bALL (?P<uids>[\d:,]+)',
+    re.I,
+)
+
+# FETCH 応答の先頭にあるメール番号と、リテラルの直前にある BODY[...] セクション名
+_FETCH_NUM_RE = re.compile(rb"^\s*(\d+) \(")
+_FETCH_SECTION_RE = re.compile(rb"BODY\[([A-Z0-9.]*)[^\]]*\](?:<\d+>)? \{\d+\}$", re.I)
+_FETCH_UID_RE = re.compile(rb"\bUID (\d+)", re.I)
+_FETCH_LABELS_RE = re.compile(rb'\bX-GM-LABELS \(((?:[^()"]|"(?:[^"\\]|\\.)*")*)\)', re.I)
+_LABEL_RE = re.compile(r'"((?:[^"\\]|\\.)*)"|(\S+)')
+
+# 結果表示と本文の解釈に必要なヘッダー
+_DETAIL_FIELDS = ("FROM", "TO", "SUBJECT", "DATE", "MESSAGE-ID",
+                  "CONTENT-TYPE", "CONTENT-TRANSFER-ENCODING")
+
+# 並列検索で先に調べるメールボックス（小文字で比較。階層の末尾名でも一致させる）
+PRIORITY_MAILBOXES = frozenset(
+    m.lower() for m in (
+        "Trash", "Deleted Items", "Deleted Messages", "Junk", "Junk E-mail", "Spam",
+        "Sent", "Sent Items", "Sent Messages", "Drafts", "Archive",
+        "[Gmail]/All Mail", "[Gmail]/Sent Mail", "[Gmail]/Trash", "[Gmail]/Spam",
+    )
+)
+
+# 深掘り検索の送信元ドメインのヒントに使うドメイン（メッセージIDのドメインかその親が一致したとき）
+# ヒントは FROM 検索とドメインの完全一致に使うので、別のドメインへ読み替えてはいけない
+_DOMAIN_HINTS = frozenset((
+    "gmail.com", "googlemail.com", "yahoo.com", "yahoo.co.jp",
+    "icloud.com", "me.com", "cpanel.net",
+))
+
+# 階層の区切り文字（末尾名の取り出し用）
+_HIERARCHY_SEP_RE = re.compile(r"[./]")
+
+# プールで待機中の接続をこれ以上放置したら使い捨てる（サーバー側のタイムアウト対策）
+_POOL_IDLE_SECONDS = 300
+
+# 本文プレビュー (200 文字) には先頭 4KB あれば十分
+_PREVIEW_BYTES = 4096
+
+# 1 回の SEARCH に OR でまとめるメッセージIDの上限
+_SEARCH_BATCH = 50
+
+# 1 回の FETCH にまとめるメール番号の上限（コマンド長の制限対策）
+_FETCH_BATCH = 100
+
+# パイプライン送信で応答を待たずに送るコマンド数の上限
+_PIPELINE_DEPTH = 32
+
+# 大きな FETCH 応答を少ない read で受け取るための読み込みバッファ
+_READ_BUFFER = 1 << 16
+
+# IMAP の日付はロケールに依存しない英語の月名を使う
+_MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun",
+           "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+
+# imaplib が知らない MULTISEARCH の ESEARCH コマンドを使えるようにする
+imaplib.Commands.setdefault("ESEARCH", ("AUTH", "SELECTED"))
+
+
+class _IMAP4_SSL(imaplib.IMAP4_SSL):
+    """読み込みバッファを広げ、前回の TLS セッションを再開できる IMAP4_SSL"""
+
+    def __init__(self, host: str, port: int, ssl_context: ssl.SSLContext,
+                 tls_session: Optional[ssl.SSLSession] = None):
+        self._tls_session = tls_session
+        super().__init__(host, port, ssl_context=ssl_context)
+
+    def _create_socket(self, timeout):
+        # SO_RCVBUF は設定しない（固定すると OS の受信バッファ自動調整が無効になる）
+        sock = imaplib.IMAP4._create_socket(self, timeout)
+        return self.ssl_context.wrap_socket(
+            sock, server_hostname=self.host, session=self._tls_session
+        )
+
+    def open(self, host="", port=imaplib.IMAP4_SSL_PORT, timeout=None):
+        # CPython 3.11 の imaplib.IMAP4.open を写したもの（host / port / sock / file を設定する）。
+        # 既定の 8KB ではリテラルの読み込みが細切れになるので、file だけ大きなバッファで作る。
+        # imaplib の内部構造に依存するので、Python を更新したら IMAP4.open と見比べること
+        self.host = host
+        self.port = port
+        self.sock = self._create_socket(timeout)
+        self.file = self.sock.makefile("rb", buffering=_READ_BUFFER)
+
+
+@functools.lru_cache(maxsize=None)
+def _ssl_context() -> ssl.SSLContext:
+    """全接続で共有する SSLContext（スレッドセーフで、セッション再開にも同じものが必要）"""
+    # 証明書の扱いは imaplib.IMAP4_SSL が ssl_context 未指定時に作るものと同じにする
+    # (CPython 3.11 の imaplib が使う非公開の ssl._create_stdlib_context)
+    context = ssl._create_stdlib_context()
+    context.options |= ssl.OP_NO_COMPRESSION
+    return context
 
 
 class IMAPEmailSearcher:
@@ -18,12 +157,41 @@ class IMAPEmailSearcher:
         self.server = server
         self.port = port
         self.connection = None
+        self._username = None
+        self._password = None
+        self._selected: Optional[str] = None
+        # 認証後の CAPABILITY（最初の接続で取得し、以降の接続でも使い回す）
+        self._capabilities: Optional[Tuple[str, ...]] = None
+        # 並列検索用の接続で TLS のフルハンドシェイクを省くためのセッション
+        self._tls_session: Optional[ssl.SSLSession] = None
+        self._mailboxes_cache: Optional[List[str]] = None
+        # INBOX 以外を優先順に並べた走査順（一覧のキャッシュと一緒に作り直す）
+        self._scan_order: List[str] = []
+        # Gmail の「すべてのメール」(LIST の \All フラグ。表示言語で名前が変わる)
+        self._all_mail: Optional[str] = None
+        # 並列検索用の接続プール (接続, 最終使用時刻)
+        self._pool: "queue.Queue[Tuple[imaplib.IMAP4, float]]" = queue.Queue()
+        # 深掘り検索用のヘッダーキャッシュ (メールボックス, UID) -> ヘッダー
+        self._hdr_cache: Dict[Tuple[str, int], Dict[str, str]] = {}
+        self._uidvalidity: Dict[str, int] = {}
+        # 実行をまたいで保持するメッセージID -> [メールボックス, UIDVALIDITY, UID]
+        self._mid_cache: Dict[str, list] = {}
+        self._mid_cache_lock = threading.Lock()
+        # 読み込めたときだけ保存する（接続に失敗したまま空で上書きしない）
+        self._mid_cache_loaded = False
 
     def connect(self, username: str, password: str) -> bool:
         """IMAPサーバーに接続"""
         try:
-            self.connection = imaplib.IMAP4_SSL(self.server, self.port)
-            self.connection.login(username, password)
+            self._username = username
+            self._password = password
+            self._mailboxes_cache = None
+            self._all_mail = None
+            self._capabilities = None
+            self._mid_cache_loaded = False
+            self.connection = self._open_connection()
+            self._mid_cache = _load_mid_cache(self._mid_cache_path())
+            self._mid_cache_loaded = True
             print(f"✅ {self.server} に正常に接続しました")
             return True
         except imaplib.IMAP4.error as e:
@@ -33,33 +201,131 @@ class IMAPEmailSearcher:
             print(f"❌ 接続エラー: {e}")
             return False
 
+    def _open_connection(self):
+        """保存済みの認証情報で新しい IMAP 接続を開く"""
+        conn = _IMAP4_SSL(self.server, self.port, _ssl_context(), self._tls_session)
+        conn.login(self._username, self._password)
+        self._refresh_capabilities(conn)
+        # TLS 1.3 のチケットはハンドシェイク後に届くので、ログインの応答を読んでから保存する
+        if conn.sock.session is not None:
+            self._tls_session = conn.sock.session
+        return conn
+
+    def _acquire_connection(self):
+        """プールから接続を取り出す（空、または放置されすぎた接続しか無ければ新規に開く）"""
+        while True:
+            try:
+                conn, last_used = self._pool.get_nowait()
+            except queue.Empty:
+                return self._open_connection()
+            if time.monotonic() - last_used < _POOL_IDLE_SECONDS:
+                return conn
+            _logout_quietly(conn)
+
+    def _release_connection(self, conn):
+        """接続を次の並列検索で再利用できるようプールへ戻す"""
+        self._pool.put((conn, time.monotonic()))
+
     def list_mailboxes(self) -> List[str]:
-        """利用可能なメールボックス一覧を取得"""
+        """利用可能なメールボックス一覧を取得（接続中はキャッシュを返す）"""
         if not self.connection:
             print("❌ 接続されていません")
             return []
+        if self._mailboxes_cache is not None:
+            return list(self._mailboxes_cache)
         try:
             status, mailboxes = self.connection.list()
             mailbox_list = []
-            for mailbox in mailboxes:
-                decoded = mailbox.decode()
-                if "\\Noselect" in decoded:
+            for item in mailboxes:
+                # リテラルで返された名前は (応答行, 名前) のタプルになる
+                line, literal = item if isinstance(item, tuple) else (item, None)
+                if not line:
+                    continue
+                m = _LIST_RE.match(line)
+                if not m:
+                    name = _list_name_fallback(line)
+                    if name:
+                        mailbox_list.append(name)
                     continue
-                name = decoded.split('"')[-2] if '"' in decoded else decoded.split()[-1]
+                flags = m["flags"].lower().split()
+                if any(flag in flags for flag in _LIST_SKIP_FLAGS):
+                    continue
+                if m["qname"] is not None:
+                    name = _unquote(m["qname"].decode(errors="ignore"))
+                elif m["literal"] is not None:
+                    if literal is None:
+                        continue
+                    name = literal.decode(errors="ignore")
+                else:
+                    name = m["name"].decode(errors="ignore")
+                if b"\\all" in flags:
+                    self._all_mail = name
                 mailbox_list.append(name)
-            return mailbox_list
+            self._mailboxes_cache = mailbox_list
+            self._scan_order = _prioritize_mailboxes(
+                [m for m in dict.fromkeys(mailbox_list) if m.upper() != "INBOX"]
+            )
+            return list(mailbox_list)
         except Exception as e:
             print(f"❌ メールボックス取得エラー: {e}")
             return []
 
+    def scan_order(self) -> List[str]:
+        """INBOX 以外のメールボックスを優先順 (PRIORITY_MAILBOXES が先) で返す"""
+        if self._mailboxes_cache is None:
+            self.list_mailboxes()
+        return list(self._scan_order)
+
+    def invalidate_mailboxes_cache(self):
+        """メールボックスの作成・削除後などに一覧のキャッシュを破棄"""
+        self._mailboxes_cache = None
+
+    def skip_empty_mailboxes(self, mailboxes: List[str]) -> List[str]:
+        """
+        メッセージが 0 件のメールボックスを除く（順序は保つ）
+        件数が分からないメールボックスは残す
+        """
+        if not self.connection or not mailboxes:
+            return list(mailboxes)
+        try:
+            counts = self._message_counts(mailboxes)
+        except Exception as e:
+            print(f"⚠️ メールボックスの件数取得に失敗しました: {e}")
+            return list(mailboxes)
+        return [m for m in mailboxes if counts.get(m, 1) > 0]
+
+    def _message_counts(self, mailboxes: List[str]) -> Dict[str, int]:
+        """メールボックス名 -> メッセージ数"""
+        conn = self.connection
+        if "LIST-STATUS" in conn.capabilities:
+            # RFC 5819: LIST と同時に全メールボックスの件数を 1 往復で受け取る
+            status, data = conn._simple_command(
+                "LIST", '""', '"*"', "RETURN", "(STATUS (MESSAGES))"
+            )
+            conn._untagged_response(status, data, "LIST")  # 一覧自体は使わない
+            status, data = conn._untagged_response(status, data, "STATUS")
+            if status == "OK":
+                return _parse_status_counts(data)
+        # 非対応サーバーでは STATUS を応答を待たずに続けて送り、往復を 1 回分にまとめる
+        return self._run_pooled(self._status_on, mailboxes)
+
+    def _status_on(self, conn, mailboxes: List[str]) -> Dict[str, int]:
+        """指定の接続で全メールボックスの STATUS (MESSAGES) をパイプライン送信"""
+        _, data = _pipelined(
+            conn, "STATUS", [(_quote(m), "(MESSAGES)") for m in mailboxes], "STATUS"
+        )
+        return _parse_status_counts(data)
+
     def select_mailbox(self, mailbox: str = "INBOX") -> bool:
         """メールボックスを選択"""
         if not self.connection:
             print("❌ 接続されていません")
             return False
         try:
-            status, _ = self.connection.select(mailbox, readonly=True)
+            status, _ = self.connection.select(_quote(mailbox), readonly=True)
             if status == "OK":
+                self._selected = mailbox
+                self._check_uidvalidity(mailbox)
                 print(f"✅ メールボックス '{mailbox}' を選択しました")
                 return True
             else:
@@ -69,70 +335,708 @@ class IMAPEmailSearcher:
             print(f"❌ メールボックス選択エラー: {e}")
             return False
 
+    def _check_uidvalidity(self, mailbox: str):
+        """SELECT 応答の UIDVALIDITY が変わっていればそのメールボックスのキャッシュを捨てる"""
+        uidvalidity = _selected_uidvalidity(self.connection)
+        if not uidvalidity:
+            return
+        if self._uidvalidity.get(mailbox) != uidvalidity:
+            self._hdr_cache = {
+                key: value for key, value in self._hdr_cache.items() if key[0] != mailbox
+            }
+            self._uidvalidity[mailbox] = uidvalidity
+
     def search_by_message_id(self, message_id: str) -> Optional[dict]:
         """メッセージIDでメールを検索"""
         if not self.connection:
             print("❌ 接続されていません")
             return None
         try:
-            search_criteria = f'HEADER Message-ID "{message_id}"'
-            status, message_numbers = self.connection.search(None, search_criteria)
+            info = self._find_message(self.connection, message_id)
+            if info is None:
+                print(f"❌ メッセージID '{message_id}' が見つかりませんでした")
+                return None
+            info["mailbox"] = self._selected
+            self._remember(self._selected, self._uidvalidity.get(self._selected), info)
+            return info
+        except Exception as e:
+            print(f"❌ 検索エラー: {e}")
+            return None
+
+    def search_by_message_id_parallel(
+        self, message_id: str, mailboxes: List[str], workers: int = 4
+    ) -> Optional[dict]:
+        """
+        複数のメールボックスを並列接続で検索
+        Args:
+            message_id: 検索するメッセージID
+            mailboxes: 検索対象のメールボックス名
+            workers: 同時接続数（サーバーの同時セッション上限に注意）
+        """
+        if not self.connection:
+            print("❌ 接続されていません")
+            return None
+        if not mailboxes:
+            return None
+        workers = max(1, min(workers, len(mailboxes)))
+        # 先頭ほど優先度が高いので、各ワーカーへ交互に割り振る
+        chunks = [mailboxes[i::workers] for i in range(workers)]
+        found = threading.Event()
+        result = None
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(self._run_pooled, self._scan_on, message_id, chunk, found)
+                for chunk in chunks
+            ]
+            for future in as_completed(futures):
+                try:
+                    info = future.result()
+                except Exception as e:
+                    print(f"❌ 並列検索エラー: {e}")
+                    continue
+                if info and result is None:
+                    result = info
+        if result is None:
+            print(f"❌ メッセージID '{message_id}' はどのメールボックスにも見つかりませんでした")
+        return result
+
+    def iter_message_ids_parallel(
+        self, message_ids: List[str], mailboxes: List[str], workers: int = 4
+    ) -> Iterator[Tuple[str, dict]]:
+        """
+        複数のメッセージIDを複数のメールボックスから並列接続で検索
+        全体の完了を待たず、見つかった順に (入力したメッセージID, メール詳細) を返す
+        """
+        if not self.connection:
+            print("❌ 接続されていません")
+            return
+        if not mailboxes or not message_ids:
+            return
+        workers = max(1, min(workers, len(mailboxes)))
+        chunks = [mailboxes[i::workers] for i in range(workers)]
+        found: "queue.Queue[Optional[Tuple[str, dict]]]" = queue.Queue()
+        # 全ワーカーで共有する未発見の ID（見つかった ID は以降の SEARCH から外す）
+        remaining = set(message_ids)
+        lock = threading.Lock()
+
+        def worker(chunk: List[str]):
+            try:
+                self._run_pooled(self._scan_many_on, remaining, lock, chunk, found.put)
+            except Exception as e:
+                print(f"❌ 並列検索エラー: {e}")
+            finally:
+                found.put(None)  # このワーカーの終了を知らせる
+
+        seen = set()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for chunk in chunks:
+                executor.submit(worker, chunk)
+            finished = 0
+            while finished < workers:
+                item = found.get()
+                if item is None:
+                    finished += 1
+                elif item[0] not in seen:
+                    seen.add(item[0])
+                    yield item
+
+    def _run_pooled(self, func, *args):
+        """プールの接続で func(conn, *args) を実行"""
+        conn = self._acquire_connection()
+        try:
+            result = func(conn, *args)
+        except Exception:
+            # 状態の分からない接続はプールへ戻さない
+            _logout_quietly(conn)
+            raise
+        self._release_connection(conn)
+        return result
+
+    def _select_on(self, conn, mailbox: str) -> Optional[int]:
+        """
+        指定の接続でメールボックスを読み取り専用で選択
+        Returns:
+            UIDVALIDITY（サーバーが返さなければ 0）。選択できなければ None
+        """
+        try:
+            status, _ = conn.select(_quote(mailbox), readonly=True)
+        except imaplib.IMAP4.abort:
+            raise
+        except imaplib.IMAP4.error as e:
+            print(f"⚠️ '{mailbox}' の検索をスキップしました: {e}")
+            return None
+        if status != "OK":
+            return None
+        return _selected_uidvalidity(conn)
+
+    def _scan_many_on(
+        self, conn, remaining: Set[str], lock: threading.Lock, mailboxes: List[str],
+        emit: Callable[[Tuple[str, dict]], None],
+    ):
+        """
+        指定の接続でメールボックスを順に SELECT + 一括 SEARCH し、見つかるたびに emit へ渡す
+        remaining は他のワーカーと共有し、見つかった ID を取り除いていく（空になったら終了）
+        """
+        for mailbox in mailboxes:
+            with lock:
+                message_ids = list(remaining)
+            if not message_ids:
+                return
+            uidvalidity = self._select_on(conn, mailbox)
+            if uidvalidity is None:
+                continue
+            try:
+                found = self.search_by_message_ids(message_ids, conn)
+            except imaplib.IMAP4.abort:
+                raise
+            except imaplib.IMAP4.error as e:
+                print(f"⚠️ '{mailbox}' の検索をスキップしました: {e}")
+                continue
+            for mid, info in found.items():
+                with lock:
+                    if mid not in remaining:
+                        continue  # 他のワーカーが先に見つけた
+                    remaining.discard(mid)
+                info["mailbox"] = mailbox
+                self._remember(mailbox, uidvalidity, info)
+                emit((mid, info))
+
+    def _scan_on(
+        self, conn, message_id: str, mailboxes: List[str], found: threading.Event
+    ) -> Optional[dict]:
+        """指定の接続でメールボックスを順に SELECT + SEARCH"""
+        for mailbox in mailboxes:
+            if found.is_set():
+                return None
+            uidvalidity = self._select_on(conn, mailbox)
+            if uidvalidity is None:
+                continue
+            try:
+                info = self._find_message(conn, message_id)
+            except imaplib.IMAP4.abort:
+                raise
+            except imaplib.IMAP4.error as e:
+                print(f"⚠️ '{mailbox}' の検索をスキップしました: {e}")
+                continue
+            if info is not None:
+                found.set()
+                info["mailbox"] = mailbox
+                self._remember(mailbox, uidvalidity, info)
+                return info
+        return None
+
+    def _find_message(self, conn, message_id: str) -> Optional[dict]:
+        """
+        選択中のメールボックスからメッセージIDに一致するメールの詳細を返す
+        < > 付き／無しの両方を 1 回の SEARCH で照合する。HEADER 検索は部分一致なので
+        (w1@y.com で xw1@y.com にも当たる)、取得した Message-ID が一致するものだけを返す
+        """
+        key = _mid_key(message_id)
+        criteria = _mid_criteria(message_id)
+        checked = None
+        if "ESEARCH" in conn.capabilities:
+            # RFC 4731: 一致した番号の一覧ではなく最小値だけを返させる（大抵はこれが目的のメール）
+            status, data = conn._simple_command("SEARCH", "RETURN", "(MIN)", criteria)
+            status, data = conn._untagged_response(status, data, "ESEARCH")
             if status != "OK":
-                print(f"❌ 検索失敗: {status}")
                 return None
-            message_nums = message_numbers[0].split()
-            if not message_nums:
-                print(f"❌ メッセージID '{message_id}' が見つかりませんでした")
+            found = _parse_esearch(data).get("MIN")
+            if not found:
                 return None
-            msg_num = message_nums[0]
-            return self._fetch_email_details(msg_num.decode())
+            checked = str(found).encode()
+            info = self._fetch_email_details(checked.decode(), conn)
+            if info and _mid_key(info["message_id"]) == key:
+                return info
+        # 最小の番号が別のメールだった場合は、一致した番号をすべて確かめる
+        status, data = conn.search(None, criteria)
+        if status != "OK":
+            print(f"❌ 検索失敗: {status}")
+            return None
+        message_nums = [num for num in data[0].split() if num != checked]
+        for info in self._fetch_details_bulk(message_nums, conn):
+            if _mid_key(info["message_id"]) == key:
+                return info
+        return None
+
+    def search_by_message_ids(self, message_ids: List[str], conn=None) -> Dict[str, dict]:
+        """
+        選択中のメールボックスで複数のメッセージIDをまとめて検索
+        ID ごとに SEARCH せず、OR で連結した 1 回の SEARCH と 1 回の FETCH で済ませる
+        Args:
+            conn: 並列検索の接続。指定時のエラーは呼び出し側でメールボックス単位に扱う
+        Returns:
+            入力したメッセージID -> メール詳細（エラー時はそれまでに見つかった分）
+        """
+        on_main = conn is None
+        if on_main and not self.connection:
+            print("❌ 接続されていません")
+            return {}
+        conn = conn or self.connection
+        lookup = {_mid_key(mid): mid for mid in message_ids}
+        bares = [_bare_mid(mid) for mid in lookup.values()]
+        results = {}
+        try:
+            # 長すぎるコマンドはサーバーに拒否されるので、一定数ごとに分けて送る
+            for i in range(0, len(bares), _SEARCH_BATCH):
+                nums = self._search_mid_batch(conn, bares[i:i + _SEARCH_BATCH])
+                for info in self._fetch_details_bulk(nums, conn):
+                    mid = lookup.get(_mid_key(info["message_id"]))
+                    if mid is not None and mid not in results:
+                        if on_main:
+                            info["mailbox"] = self._selected
+                            self._remember(
+                                self._selected, self._uidvalidity.get(self._selected), info
+                            )
+                        results[mid] = info
         except Exception as e:
+            if not on_main:
+                raise
             print(f"❌ 検索エラー: {e}")
+        return results
+
+    def _search_mid_batch(self, conn, batch: List[str]) -> List[bytes]:
+        """
+        OR で連結した SEARCH を送り、一致したメール番号を返す
+        BAD で拒否されたら (コマンド長の制限など) 半分に分けて送り直し、1 件でも拒否されたら飛ばす
+        """
+        criteria = "OR " * (len(batch) - 1) + " ".join(_mid_criteria(b) for b in batch)
+        try:
+            status, data = conn.search(None, criteria)
+        except imaplib.IMAP4.abort:
+            raise
+        except imaplib.IMAP4.error as e:
+            if len(batch) == 1:
+                print(f"⚠️ '{batch[0]}' の検索をスキップしました: {e}")
+                return []
+            half = len(batch) // 2
+            return self._search_mid_batch(conn, batch[:half]) + self._search_mid_batch(conn, batch[half:])
+        if status != "OK":
+            print(f"❌ 検索失敗: {status}")
+            return []
+        return data[0].split()
+
+    def search_gmail(self, message_ids: List[str]) -> Dict[str, dict]:
+        """
+        Gmail (X-GM-EXT-1) では「すべてのメール」を X-GM-RAW の rfc822msgid: で一度だけ検索する
+        メールボックスごとの走査は不要で、付いているラベルも同じ FETCH で取得する
+        Returns:
+            入力したメッセージID -> メール詳細（非対応サーバーでは空）
+        """
+        if not self.connection or "X-GM-EXT-1" not in self.connection.capabilities:
+            return {}
+        self.list_mailboxes()
+        if not self._all_mail:
+            return {}
+        try:
+            return self._run_pooled(self._search_gmail_on, message_ids)
+        except Exception as e:
+            print(f"⚠️ Gmail 検索に失敗しました: {e}")
+            return {}
+
+    def _search_gmail_on(self, conn, message_ids: List[str]) -> Dict[str, dict]:
+        """指定の接続で「すべてのメール」を選択し、X-GM-RAW でまとめて検索"""
+        mailbox = self._all_mail
+        uidvalidity = self._select_on(conn, mailbox)
+        if uidvalidity is None:
+            return {}
+        lookup = {_mid_key(mid): mid for mid in message_ids}
+        bares = [_bare_mid(mid) for mid in lookup.values()]
+        results = {}
+        for i in range(0, len(bares), _SEARCH_BATCH):
+            query = " OR ".join(f"rfc822msgid:{b}" for b in bares[i:i + _SEARCH_BATCH])
+            status, data = conn.search(None, "X-GM-RAW", _quote(query))
+            if status != "OK":
+                continue
+            for info in self._fetch_details_bulk(data[0].split(), conn, labels=True):
+                mid = lookup.get(_mid_key(info["message_id"]))
+                if mid is not None and mid not in results:
+                    info["mailbox"] = mailbox
+                    self._remember(mailbox, uidvalidity, info)
+                    results[mid] = info
+        return results
+
+    def search_all_mailboxes(self, message_ids: List[str]) -> Optional[Dict[str, dict]]:
+        """
+        MULTISEARCH (RFC 7377) 対応サーバーでは ESEARCH IN (PERSONAL) で全メールボックスを
+        サーバー側で一度に検索し、ヒットしたメールボックスだけ UID FETCH する
+        Returns:
+            入力したメッセージID -> メール詳細。非対応・失敗時は None（メールボックスを順に走査する）
+        """
+        if not self.connection or "MULTISEARCH" not in self.connection.capabilities:
             return None
+        conn = self.connection
+        lookup = {_mid_key(mid): mid for mid in message_ids}
+        bares = [_bare_mid(mid) for mid in lookup.values()]
+        by_mailbox: Dict[str, list] = {}
+        try:
+            for i in range(0, len(bares), _SEARCH_BATCH):
+                batch = bares[i:i + _SEARCH_BATCH]
+                criteria = "OR " * (len(batch) - 1) + " ".join(_mid_criteria(b) for b in batch)
+                status, data = conn._simple_command(
+                    "ESEARCH", "IN", "(PERSONAL)", "RETURN", "(ALL)", criteria
+                )
+                status, data = conn._untagged_response(status, data, "ESEARCH")
+                if status != "OK":
+                    print(f"⚠️ 全メールボックス検索に失敗しました: {status}")
+                    return None
+                for item in data:
+                    m = _MULTISEARCH_RE.search(item) if isinstance(item, bytes) else None
+                    if not m:
+                        continue
+                    name = m["qname"] if m["qname"] is not None else m["name"]
+                    mailbox = _unquote(name.decode(errors="ignore"))
+                    uids = by_mailbox.setdefault(mailbox, [int(m["uidvalidity"]), []])[1]
+                    uids.extend(_expand_uid_set(m["uids"].decode()))
+        except (imaplib.IMAP4.error, OSError) as e:
+            # 切断なども含め、メールボックスを順に走査する方法に切り替えさせる
+            print(f"⚠️ 全メールボックス検索に失敗しました: {e}")
+            return None
+        results = {}
+        for mailbox, (uidvalidity, uids) in by_mailbox.items():
+            entries = [(uidvalidity, uid) for uid in uids]
+            try:
+                found = self._run_pooled(self._fetch_found_on, mailbox, entries, lookup)
+            except Exception as e:
+                print(f"⚠️ '{mailbox}' のメール取得に失敗しました: {e}")
+                continue
+            for mid, info in found.items():
+                results.setdefault(mid, info)
+        return results
+
+    def _fetch_found_on(
+        self, conn, mailbox: str, entries: List[Tuple[int, int]], lookup: Dict[str, str]
+    ) -> Dict[str, dict]:
+        """指定の接続でメールボックスを選択し、(UIDVALIDITY, UID) のメールをまとめて取得して照合"""
+        uidvalidity = self._select_on(conn, mailbox)
+        if uidvalidity is None:
+            return {}
+        uids = [str(uid).encode() for v, uid in entries if not uidvalidity or v == uidvalidity]
+        results = {}
+        for info in self._fetch_details_bulk(uids, conn, uid=True):
+            mid = lookup.get(_mid_key(info["message_id"]))
+            if mid is not None and mid not in results:
+                info["mailbox"] = mailbox
+                self._remember(mailbox, uidvalidity, info)
+                results[mid] = info
+        return results
 
-    def search_emails(self, criteria: str) -> List[dict]:
+    def search_cached(self, message_ids: List[str]) -> Dict[str, dict]:
+        """
+        前回までに見つけた位置 (メールボックス, UID) を UID FETCH で確認して返す
+        メールボックスの走査は行わず、UIDVALIDITY が変わった／削除された ID はキャッシュから外す
+        """
+        if not self.connection:
+            print("❌ 接続されていません")
+            return {}
+        by_mailbox: Dict[str, list] = {}
+        with self._mid_cache_lock:
+            for mid in message_ids:
+                entry = self._mid_cache.get(_mid_key(mid))
+                if entry:
+                    mailbox, uidvalidity, uid = entry
+                    by_mailbox.setdefault(mailbox, []).append((uidvalidity, uid, mid))
+        results = {}
+        for mailbox, entries in by_mailbox.items():
+            try:
+                results.update(self._run_pooled(self._verify_cached_on, mailbox, entries))
+            except Exception as e:
+                print(f"⚠️ キャッシュの確認に失敗しました ({mailbox}): {e}")
+        return results
+
+    def _verify_cached_on(
+        self, conn, mailbox: str, entries: List[Tuple[int, int, str]]
+    ) -> Dict[str, dict]:
+        """キャッシュされた UID のメールを 1 回の UID FETCH で取得し、Message-ID を照合"""
+        uidvalidity = self._select_on(conn, mailbox)
+        if uidvalidity is None:
+            return {}
+        wanted = {}
+        uids = []
+        for cached_uidvalidity, uid, mid in entries:
+            if cached_uidvalidity == uidvalidity:
+                wanted[_mid_key(mid)] = mid
+                uids.append(str(uid).encode())
+            else:
+                self._forget(mid)
+        if not wanted:
+            return {}
+        results = {}
+        for info in self._fetch_details_bulk(uids, conn, uid=True):
+            mid = wanted.get(_mid_key(info["message_id"]))
+            if mid is not None:
+                info["mailbox"] = mailbox
+                results[mid] = info
+        for mid in wanted.values():
+            if mid not in results:
+                self._forget(mid)
+        return results
+
+    def _remember(self, mailbox: Optional[str], uidvalidity: Optional[int], info: dict):
+        """見つかったメールの位置をキャッシュに記録"""
+        if mailbox and uidvalidity and info.get("uid"):
+            with self._mid_cache_lock:
+                self._mid_cache[_mid_key(info["message_id"])] = [
+                    mailbox, uidvalidity, info["uid"]
+                ]
+
+    def _forget(self, message_id: str):
+        """古くなったキャッシュを削除"""
+        with self._mid_cache_lock:
+            self._mid_cache.pop(_mid_key(message_id), None)
+
+    def _mid_cache_path(self) -> str:
+        """サーバーとユーザーごとのキャッシュファイルのパス"""
+        name = re.sub(r"[^\w.@-]", "_", f"{self.server}_{self._username}")
+        return os.path.join(os.path.expanduser("~"), ".cache", "imap_mid_search", f"{name}.json")
+
+    def search_by_message_id_deep(
+        self, message_id: str, from_domain_hint: Optional[str] = None
+    ) -> Optional[dict]:
+        """
+        深掘り検索: メッセージIDに含まれる日時の ±1日 に届いたメールの
+        ヘッダーを直接検証する（HEADER 検索が効かないサーバー向け）
+        Args:
+            message_id: 検索するメッセージID
+            from_domain_hint: 送信元ドメインで候補を絞り込む場合に指定
+        """
+        if not self.connection:
+            print("❌ 接続されていません")
+            return None
+        key = _mid_key(message_id)
+        timestamp = _parse_mid_timestamp(message_id)
+        if timestamp is None:
+            print("⚠️ メッセージIDに日時が含まれていないため深掘り検索できません")
+            return None
+        hint = from_domain_hint.lower().lstrip("@") if from_domain_hint else None
+        criteria = [
+            "SINCE", _imap_date(timestamp - timedelta(days=1)),
+            "BEFORE", _imap_date(timestamp + timedelta(days=2)),
+        ]
+        if hint:
+            # ドメインでの粗い絞り込みはサーバー側で行い、ヘッダーを取得する候補自体を減らす
+            criteria += ["FROM", _quote(hint)]
+        try:
+            candidates = self._search_uid_window(criteria)
+            if not candidates:
+                return None
+            mailbox = self._selected
+            # キャッシュに無い UID だけ、結果表示に使うヘッダーまで 1 回でまとめて取得する
+            missing = [uid for uid in candidates if (mailbox, uid) not in self._hdr_cache]
+            if missing:
+                fetched = self._fetch_headers_bulk(missing, _DETAIL_FIELDS)
+                for uid, msg in fetched.items():
+                    self._hdr_cache[(mailbox, uid)] = msg
+            # 絞り込みに使う列だけを並列リストにして 1 パスで走査する
+            uids = [uid for uid in candidates if (mailbox, uid) in self._hdr_cache]
+            headers = [self._hdr_cache[(mailbox, uid)] for uid in uids]
+            # 部分一致ではなく、取り出した Message-ID の値どうしを比較する
+            mids = [_mid_key(h.get("message-id", "")) for h in headers]
+            if hint:
+                # 表示名の中の文字列に反応しないよう、アドレスのドメイン部分だけで比較する
+                from_domains = [_address_domains(h.get("from", "")) for h in headers]
+                hits = [
+                    i for i, domains in enumerate(from_domains)
+                    if any(d == hint or d.endswith("." + hint) for d in domains)
+                ]
+            else:
+                hits = range(len(uids))
+            for i in hits:
+                if mids[i] == key:
+                    info = self._fetch_preview_by_uid(uids[i], headers[i])
+                    if info:
+                        info["mailbox"] = mailbox
+                        self._remember(mailbox, self._uidvalidity.get(mailbox), info)
+                    return info
+            return None
+        except Exception as e:
+            print(f"❌ 深掘り検索エラー: {e}")
+            return None
+
+    def _search_uid_window(self, criteria: List[str]) -> List[int]:
+        """
+        条件に一致する UID の候補を返す
+        ESEARCH 対応サーバーでは UID の一覧ではなく MIN / MAX / COUNT だけを受け取り、範囲で返す
+        """
+        conn = self.connection
+        if "ESEARCH" in conn.capabilities:
+            status, data = conn._simple_command(
+                "UID", "SEARCH", "RETURN", "(MIN MAX COUNT)", *criteria
+            )
+            status, data = conn._untagged_response(status, data, "ESEARCH")
+            if status != "OK":
+                print(f"❌ 検索失敗: {status}")
+                return []
+            result = _parse_esearch(data)
+            if not result.get("COUNT"):
+                return []
+            low, high = result["MIN"], result["MAX"]
+            # 範囲内の大半が条件外（古い日付のメールを後から取り込んだ場合など）なら一覧を取り直す
+            if high - low + 1 <= result["COUNT"] * 4 + _FETCH_BATCH:
+                return list(range(low, high + 1))
+        status, data = conn.uid("SEARCH", *criteria)
+        if status != "OK":
+            print(f"❌ 検索失敗: {status}")
+            return []
+        return [int(uid) for uid in data[0].split()]
+
+    def _fetch_headers_bulk(self, uids: List[int], fields, conn=None) -> Dict[int, Dict[str, str]]:
+        """
+        複数メールの指定ヘッダーを UID FETCH BODY.PEEK[HEADER.FIELDS] でまとめて取得
+        Returns:
+            UID -> {小文字のヘッダー名: 値}
+        """
+        conn = conn or self.connection
+        spec = f"(BODY.PEEK[HEADER.FIELDS ({' '.join(fields)})])"
+        headers = {}
+        # 範囲ごとの UID FETCH は応答を待たずに続けて送る
+        _, data = _pipelined(conn, "UID", [("FETCH", s, spec) for s in _uid_sets(uids)], "FETCH")
+        for sections in _parse_fetch(data).values():
+            if b"UID" in sections and b"HEADER.FIELDS" in sections:
+                headers[int(sections[b"UID"])] = _parse_header_fields(sections[b"HEADER.FIELDS"])
+        return headers
+
+    def _fetch_details_bulk(
+        self, nums: List[bytes], conn=None, uid: bool = False, labels: bool = False
+    ) -> List[dict]:
+        """
+        複数メールのヘッダーと本文を 1 回の FETCH で取得して結果を組み立てる
+        Args:
+            nums: メール番号（uid=True の場合は UID）
+            labels: Gmail の X-GM-LABELS も取得して結果の "labels" に入れる
+        """
+        conn = conn or self.connection
+        if not nums:
+            return []
+        spec = (
+            f"(UID {'X-GM-LABELS ' if labels else ''}"
+            f"BODY.PEEK[HEADER.FIELDS ({' '.join(_DETAIL_FIELDS)})] "
+            f"BODY.PEEK[TEXT]<0.{_PREVIEW_BYTES}>)"
+        )
+        if uid:
+            status, data = conn.uid("FETCH", b",".join(nums), spec)
+        else:
+            status, data = conn.fetch(b",".join(nums), spec)
+        if status != "OK":
+            return []
+        emails = []
+        for num, sections in _parse_fetch(data).items():
+            if b"HEADER.FIELDS" not in sections:
+                continue
+            headers = _parse_header_fields(sections[b"HEADER.FIELDS"])
+            body = self._body_from_text(headers, sections.get(b"TEXT", b""))
+            info = self._build_email_info(num.decode(), headers, body, sections.get(b"UID"))
+            if labels:
+                info["labels"] = _parse_labels(sections.get(b"X-GM-LABELS", b""))
+            emails.append(info)
+        return emails
+
+    def _fetch_preview_by_uid(self, uid: int, headers: Dict[str, str]) -> Optional[dict]:
+        """本文の先頭だけを UID で取得し、取得済みヘッダーと合わせて結果を作る"""
+        status, data = self.connection.uid(
+            "FETCH", str(uid), f"(BODY.PEEK[TEXT]<0.{_PREVIEW_BYTES}>)"
+        )
+        if status != "OK":
+            return None
+        for num, sections in _parse_fetch(data).items():
+            body = self._body_from_text(headers, sections.get(b"TEXT", b""))
+            return self._build_email_info(num.decode(), headers, body, uid)
+        return None
+
+    def _body_from_text(self, headers: Dict[str, str], text: bytes) -> str:
+        """ヘッダーの MIME 情報と BODY[TEXT] を組み合わせて本文を取り出す"""
+        mime = "".join(
+            f"{name}: {headers[name]}\r\n"
+            for name in ("content-type", "content-transfer-encoding")
+            if name in headers
+        )
+        # 連結したバイト列を作らず、MIME ヘッダーと本文をそのままパーサーへ流し込む
+        parser = BytesFeedParser()
+        parser.feed(mime.encode())
+        parser.feed(b"\r\n")
+        parser.feed(text)
+        return self._get_email_body(parser.close())
+
+    def _build_email_info(self, msg_num: str, headers: Dict[str, str], body: str, uid=None) -> dict:
+        """ヘッダー (小文字の名前 -> 値) と本文から検索結果の辞書を作成"""
+        return {
+            "message_number": msg_num,
+            "uid": int(uid) if uid else None,
+            "message_id": headers.get("message-id", ""),
+            "subject": self._decode_header(headers.get("subject", "")),
+            "from": self._decode_header(headers.get("from", "")),
+            "to": self._decode_header(headers.get("to", "")),
+            "date": headers.get("date", ""),
+            "body": body[:200] + "..." if len(body) > 200 else body,
+        }
+
+    def _refresh_capabilities(self, conn):
+        """
+        ログイン後の CAPABILITY を反映（認証後に拡張を広告するサーバー向け）
+        LOGIN 応答の [CAPABILITY ...] を優先し、無ければ最初の接続で一度だけ問い合わせる
+        """
+        _, data = conn.response("CAPABILITY")
+        if data and data[-1]:
+            self._capabilities = tuple(data[-1].decode().upper().split())
+        elif self._capabilities is None:
+            status, data = conn.capability()
+            if status == "OK" and data and data[-1]:
+                self._capabilities = tuple(data[-1].decode().upper().split())
+        if self._capabilities:
+            conn.capabilities = self._capabilities
+
+    def search_by_field(self, field: str, value: str) -> List[dict]:
+        """
+        FROM / SUBJECT などのキーで検索
+        日本語など非 ASCII の値は CHARSET UTF-8 とリテラルで送る
+        """
+        if not self.connection:
+            print("❌ 接続されていません")
+            return []
+        if value.isascii():
+            return self.search_emails(f"{field} {_quote(value)}")
+        data = value.encode("utf-8")
+        capabilities = self.connection.capabilities
+        if "LITERAL+" in capabilities or ("LITERAL-" in capabilities and len(data) <= 4096):
+            # RFC 7888: 継続応答 (+) を待たずにリテラルを続けて送る
+            criteria = f"{field} {{{len(data)}+}}\r\n".encode() + data
+        else:
+            # imaplib が {n} を付けて継続応答を待ってから送信する
+            self.connection.literal = data
+            criteria = field
+        return self.search_emails(criteria, charset="UTF-8")
+
+    def search_emails(self, criteria, charset: Optional[str] = None) -> List[dict]:
         """指定された条件でメールを検索"""
         if not self.connection:
             print("❌ 接続されていません")
             return []
         try:
-            status, message_numbers = self.connection.search(None, criteria)
+            status, message_numbers = self.connection.search(charset, criteria)
             if status != "OK":
                 print(f"❌ 検索失敗: {status}")
                 return []
             message_nums = message_numbers[0].split()
-            emails = []
-            for msg_num in message_nums[-10:]:  # 最新10件のみ取得
-                email_info = self._fetch_email_details(msg_num.decode())
-                if email_info:
-                    emails.append(email_info)
-            return emails
+            return self._fetch_details_bulk(message_nums[-10:])  # 最新10件のみ取得
         except Exception as e:
             print(f"❌ 検索エラー: {e}")
             return []
 
-    def _fetch_email_details(self, msg_num: str) -> Optional[dict]:
+    def _fetch_email_details(self, msg_num: str, conn=None) -> Optional[dict]:
         """指定されたメール番号のメール詳細を取得"""
+        conn = conn or self.connection
         try:
-            status, msg_data = self.connection.fetch(msg_num, "(RFC822)")
+            # メール全体ではなく、ヘッダーと本文の先頭だけを 1 回の FETCH で取得する
+            status, msg_data = conn.fetch(
+                msg_num, f"(UID BODY.PEEK[HEADER] BODY.PEEK[TEXT]<0.{_PREVIEW_BYTES}>)"
+            )
             if status != "OK":
                 return None
-            msg = email.message_from_bytes(msg_data[0][1])
-            subject = self._decode_header(msg.get("Subject", ""))
-            from_addr = self._decode_header(msg.get("From", ""))
-            to_addr = self._decode_header(msg.get("To", ""))
-            date = msg.get("Date", "")
-            message_id = msg.get("Message-ID", "")
-            body = self._get_email_body(msg)
-            return {
-                "message_number": msg_num,
-                "message_id": message_id,
-                "subject": subject,
-                "from": from_addr,
-                "to": to_addr,
-                "date": date,
-                "body": body[:200] + "..." if len(body) > 200 else body,
-            }
+            sections = _parse_fetch(msg_data).get(msg_num.encode(), {})
+            if b"HEADER" not in sections:
+                return None
+            headers = _parse_header_fields(sections[b"HEADER"])
+            body = self._body_from_text(headers, sections.get(b"TEXT", b""))
+            return self._build_email_info(msg_num, headers, body, sections.get(b"UID"))
         except Exception as e:
             print(f"❌ メール取得エラー: {e}")
             return None
@@ -141,14 +1045,10 @@ class IMAPEmailSearcher:
         """メールヘッダーをデコード"""
         if not header:
             return ""
-        decoded_parts = decode_header(header)
-        decoded_str = ""
-        for part, encoding in decoded_parts:
-            if isinstance(part, bytes):
-                decoded_str += part.decode(encoding or "utf-8", errors="ignore")
-            else:
-                decoded_str += part
-        return decoded_str
+        # "=?" (RFC 2047 のエンコード語) を含まない ASCII ヘッダーはそのまま返す
+        if header.isascii() and "=?" not in header:
+            return header
+        return _decode_header_slow(header)
 
     def _get_email_body(self, msg) -> str:
         """メール本文を取得"""
@@ -168,6 +1068,12 @@ class IMAPEmailSearcher:
 
     def disconnect(self):
         """接続を終了"""
+        self._mailboxes_cache = None
+        if self._mid_cache_loaded:
+            _save_mid_cache(self._mid_cache_path(), self._mid_cache)
+        while not self._pool.empty():
+            conn, _ = self._pool.get_nowait()
+            _logout_quietly(conn)
         if self.connection:
             try:
                 self.connection.close()
@@ -177,10 +1083,298 @@ class IMAPEmailSearcher:
                 pass
 
 
+@functools.lru_cache(maxsize=4096)
+def _decode_header_slow(header: str) -> str:
+    """エンコード語を含むヘッダーをデコード（同じ送信者の From などはキャッシュから返す）"""
+    return _decode_header_parts(header)
+
+
+def _decode_header_parts(header) -> str:
+    """decode_header の結果を連結して文字列にする"""
+    parts = []
+    for part, encoding in decode_header(header):
+        if isinstance(part, bytes):
+            if not encoding or encoding == "unknown-8bit":
+                encoding = "utf-8"
+            parts.append(part.decode(encoding, errors="ignore"))
+        else:
+            parts.append(part)
+    return "".join(parts)
+
+
+def _parse_header_fields(raw: bytes) -> Dict[str, str]:
+    """ヘッダーブロックを 1 パスで 小文字のヘッダー名 -> 値 に変換（同名は先頭を採用）"""
+    fields = {}
+    for m in _HEADER_LINE_RE.finditer(raw):
+        name = m.group(1).decode("ascii").lower()
+        if name not in fields:
+            value = _HEADER_FOLD_RE.sub(b"", m.group(2)).strip()
+            fields[name] = value.decode("utf-8", errors="ignore")
+    return fields
+
+
+def _parse_status_counts(data) -> Dict[str, int]:
+    """STATUS 応答を メールボックス名 -> MESSAGES に整理"""
+    counts = {}
+    for item in data:
+        if not isinstance(item, bytes):
+            continue
+        m = _STATUS_RE.match(item.decode(errors="ignore"))
+        if not m:
+            continue
+        messages = _STATUS_MESSAGES_RE.search(m["items"])
+        if messages:
+            name = _unquote(m["qname"]) if m["qname"] is not None else m["name"]
+            counts[name] = int(messages.group(1))
+    return counts
+
+
+def _parse_esearch(data) -> Dict[str, int]:
+    """ESEARCH 応答を {"MIN": .., "MAX": .., "COUNT": ..} に整理（含まれない項目は無し）"""
+    if not data or not data[-1]:
+        return {}
+    return {
+        name.decode().upper(): int(value) for name, value in _ESEARCH_RE.findall(data[-1])
+    }
+
+
+def _uid_sets(uids: List[int]) -> Iterator[str]:
+    """
+    UID を連続部分を a:b にまとめた sequence-set にして返す
+    コマンド長の制限に掛からないよう、_FETCH_BATCH 個の範囲ごとに分ける
+    """
+    ranges = []
+    for uid in sorted(set(uids)):
+        if ranges and ranges[-1][1] == uid - 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    for i in range(0, len(ranges), _FETCH_BATCH):
+        yield ",".join(
+            str(low) if low == high else f"{low}:{high}"
+            for low, high in ranges[i:i + _FETCH_BATCH]
+        )
+
+
+def _pipelined(conn, name: str, arg_lists: List[tuple], response: str) -> Tuple[List[str], list]:
+    """
+    同じコマンドを応答を待たずに _PIPELINE_DEPTH 個ずつ続けて送り、まとめて応答を読む
+    Returns:
+        (各コマンドの結果 OK/NO/BAD, 全コマンド分の response の untagged データ)
+    """
+    statuses = []
+    data = []
+    for i in range(0, len(arg_lists), _PIPELINE_DEPTH):
+        tags = [conn._command(name, *args) for args in arg_lists[i:i + _PIPELINE_DEPTH]]
+        for tag in tags:
+            try:
+                status, _ = conn._command_complete(name, tag)
+            except imaplib.IMAP4.abort:
+                raise
+            except imaplib.IMAP4.error:
+                status = "BAD"  # 応答は読み終えているので残りのコマンドはそのまま続けられる
+            statuses.append(status)
+        _, batch = conn._untagged_response("OK", [None], response)
+        data.extend(item for item in batch if item is not None)
+    return statuses, data
+
+
+def _expand_uid_set(uid_set: str) -> List[int]:
+    """"1:3,7" のような sequence-set を UID のリストに展開"""
+    uids = []
+    for part in uid_set.split(","):
+        low, _, high = part.partition(":")
+        if not low.isdigit():
+            continue
+        if high.isdigit():
+            low, high = sorted((int(low), int(high)))
+            uids.extend(range(low, high + 1))
+        else:
+            uids.append(int(low))
+    return uids
+
+
+def _selected_uidvalidity(conn) -> int:
+    """直前の SELECT 応答に含まれる UIDVALIDITY（無ければ 0）"""
+    _, data = conn.response("UIDVALIDITY")
+    if not data or not data[-1]:
+        return 0
+    return int(data[-1])
+
+
+def _load_mid_cache(path: str) -> Dict[str, list]:
+    """メッセージIDの位置キャッシュを読み込む（無い・壊れている場合は空）"""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            # 以前のバージョンが大文字小文字を区別して保存したキーも引けるようにする
+            return {_mid_key(key): value for key, value in json.load(f).items()}
+    except Exception as e:
+        print(f"⚠️ キャッシュの読み込みに失敗しました: {e}")
+        return {}
+
+
+def _save_mid_cache(path: str, cache: Dict[str, list]):
+    """メッセージIDの位置キャッシュを保存"""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(cache, f, ensure_ascii=False)
+    except Exception as e:
+        print(f"⚠️ キャッシュの保存に失敗しました: {e}")
+
+
+def _logout_quietly(conn):
+    """エラーを無視して LOGOUT"""
+    try:
+        conn.logout()
+    except Exception:
+        pass
+
+
+def _quote(value: str) -> str:
+    """IMAP の quoted string に変換"""
+    escaped = value.replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+def _unquote(value: str) -> str:
+    """quoted string の中身のエスケープを戻す"""
+    return _QUOTED_PAIR_RE.sub(r"\1", value)
+
+
+def _list_name_fallback(line: bytes) -> Optional[str]:
+    """正規表現に合わない LIST 応答から、末尾のクォート部分（無ければ最後の語）を名前とみなす"""
+    lower = line.lower()
+    if any(flag in lower for flag in _LIST_SKIP_FLAGS):
+        return None
+    text = line.decode(errors="ignore").strip()
+    if text.endswith('"'):
+        return text[:-1].rpartition('"')[2] or None
+    return text.rpartition(" ")[2] or None
+
+
+def _parse_fetch(data) -> Dict[bytes, Dict[bytes, bytes]]:
+    """FETCH 応答を メール番号 -> {セクション名: リテラル, b"UID": UID, ...} に整理"""
+    messages = {}
+    current = None
+    for item in data:
+        head, literal = item if isinstance(item, tuple) else (item, None)
+        if not head:
+            continue
+        num = _FETCH_NUM_RE.match(head)
+        if num:
+            current = messages.setdefault(num.group(1), {})
+        if current is None:
+            continue
+        # UID などはリテラルの前後どちらに来てもよい
+        uid = _FETCH_UID_RE.search(head)
+        if uid:
+            current[b"UID"] = uid.group(1)
+        labels = _FETCH_LABELS_RE.search(head)
+        if labels:
+            current[b"X-GM-LABELS"] = labels.group(1)
+        section = _FETCH_SECTION_RE.search(head)
+        if literal is not None and section:
+            current[section.group(1).upper()] = literal
+    return messages
+
+
+def _parse_mid_timestamp(message_id: str) -> Optional[datetime]:
+    """メッセージID先頭の YYYYMMDDhhmmss を日時として取り出す（無ければ None）"""
+    m = _MID_TS_RE.match(_bare_mid(message_id))
+    if not m:
+        return None
+    return _timestamp_to_datetime(m.group(1))
+
+
+@functools.lru_cache(maxsize=1024)
+def _timestamp_to_datetime(ts: str) -> Optional[datetime]:
+    """YYYYMMDDhhmmss を日時に変換（同じ秒に生成された ID はキャッシュから返す）"""
+    try:
+        # strptime は呼び出しごとに書式を解釈するので、桁を直接切り出す
+        return datetime(
+            int(ts[0:4]), int(ts[4:6]), int(ts[6:8]),
+            int(ts[8:10]), int(ts[10:12]), int(ts[12:14]),
+        )
+    except ValueError:
+        return None
+
+
+def _parse_labels(raw: bytes) -> List[str]:
+    """X-GM-LABELS の中身をラベル名のリストにする"""
+    labels = []
+    for m in _LABEL_RE.finditer(raw.decode("utf-8", errors="ignore")):
+        quoted, atom = m.groups()
+        labels.append(_unquote(quoted) if quoted is not None else atom)
+    return labels
+
+
+def _bare_mid(message_id: str) -> str:
+    """メッセージIDから前後の空白と < > を取り除く"""
+    return message_id.strip().strip("<>")
+
+
+def _mid_key(message_id: str) -> str:
+    """照合用のメッセージID（< > やコメントを除いた値を小文字に揃える）"""
+    if not message_id:
+        return ""
+    m = _MID_BRACKET_RE.search(message_id)
+    if m:
+        return m.group(1).lower()
+    m = _MID_TOKEN_RE.search(_MID_COMMENT_RE.sub(" ", message_id))
+    return m.group(0).lower() if m else ""
+
+
+def _mid_criteria(message_id: str) -> str:
+    """< > 付き／無しのどちらの Message-ID ヘッダーにも一致する SEARCH 条件"""
+    bare = _bare_mid(message_id)
+    return f"OR HEADER Message-ID {_quote(f'<{bare}>')} HEADER Message-ID {_quote(bare)}"
+
+
+def _address_domains(header: str) -> frozenset:
+    """From などのアドレスヘッダーに含まれるドメインを小文字で返す"""
+    return frozenset(
+        addr.rpartition("@")[2].lower() for _, addr in getaddresses([header]) if "@" in addr
+    )
+
+
+def _prioritize_mailboxes(mailboxes: List[str]) -> List[str]:
+    """PRIORITY_MAILBOXES に該当するメールボックスを先頭に並べ替える (INBOX.Trash なども対象)"""
+    prioritized = []
+    remaining = []
+    for name in mailboxes:
+        lower = name.lower()
+        leaf = _HIERARCHY_SEP_RE.split(lower)[-1]
+        if lower in PRIORITY_MAILBOXES or leaf in PRIORITY_MAILBOXES:
+            prioritized.append(name)
+        else:
+            remaining.append(name)
+    return prioritized + remaining
+
+
+def _domain_hint(message_id: str) -> str:
+    """メッセージIDのドメインから送信元ドメインのヒントを引く (例: ...@mail.gmail.com -> gmail.com)"""
+    _, at, domain = _bare_mid(message_id).rpartition("@")
+    domain = domain.lower() if at else ""
+    while domain:
+        if domain in _DOMAIN_HINTS:
+            return domain
+        domain = domain.partition(".")[2]
+    return ""
+
+
+def _imap_date(dt: datetime) -> str:
+    """SEARCH SINCE/BEFORE 用の日付文字列 (例: 13-Feb-2024)"""
+    return f"{dt.day}-{_MONTHS[dt.month - 1]}-{dt.year}"
+
+
 def load_providers() -> Dict[str, dict]:
     """
     プロバイダー設定を読み込む
     providers.json が存在すれば読み込み、無ければデフォルトを返す
+    キーは入力と照合しやすいよう小文字に揃える
     """
     default = {
         "gmail": {"server": "imap.gmail.com", "port": 993},
@@ -193,13 +1387,24 @@ def load_providers() -> Dict[str, dict]:
         try:
             with open("providers.json", "r", encoding="utf-8") as f:
                 custom = json.load(f)
-            default.update(custom)
+            default.update({str(key).lower(): value for key, value in custom.items()})
             print(f"✅ providers.json を読み込みました ({len(custom)} 件追加)")
         except Exception as e:
             print(f"⚠️ providers.json の読み込みに失敗しました: {e}")
     return default
 
 
+def _print_found(message_id: str, email_info: dict):
+    """一括検索で見つかったメールを 1 件表示"""
+    print(f"\n- {message_id}")
+    print(f"   メールボックス: {email_info.get('mailbox', 'INBOX')}")
+    if email_info.get("labels"):
+        print(f"   ラベル: {', '.join(email_info['labels'])}")
+    print(f"   件名: {email_info['subject']}")
+    print(f"   送信者: {email_info['from']}")
+    print(f"   日時: {email_info['date']}")
+
+
 def main():
     print("=== IMAP メール検索プログラム ===\n")
 
@@ -239,15 +1444,52 @@ def main():
             print("2. 送信者で検索")
             print("3. 件名で検索")
             print("4. メールボックス一覧表示")
-            print("5. 終了")
+            print("5. 複数のメッセージIDで一括検索")
+            print("6. 終了")
 
-            choice = input("\n選択してください (1-5): ")
+            choice = input("\n選択してください (1-6): ")
 
             if choice == "1":
                 message_id = input("検索するメッセージID: ")
-                result = searcher.search_by_message_id(message_id)
+                result = searcher.search_cached([message_id]).get(message_id)
+                if not result:
+                    result = searcher.search_by_message_id(message_id)
+                if not result:
+                    result = searcher.search_gmail([message_id]).get(message_id)
+                searched_all = False
+                if not result:
+                    found_all = searcher.search_all_mailboxes([message_id])
+                    if found_all is not None:
+                        searched_all = True
+                        result = found_all.get(message_id)
+                others = []
+                if not result:
+                    others = searcher.skip_empty_mailboxes(searcher.scan_order())
+                    if others and not searched_all:
+                        print(f"🔎 他の {len(others)} 個のメールボックスを並列検索します...")
+                        result = searcher.search_by_message_id_parallel(message_id, others)
+                if not result and _parse_mid_timestamp(message_id) is None:
+                    # 日時が無ければどのメールボックスでも深掘り検索できないので、選択して回らない
+                    print("⚠️ メッセージIDに日時が含まれていないため深掘り検索できません")
+                elif not result and input("深掘り検索を行いますか？ (y/N): ").lower() == "y":
+                    default_hint = _domain_hint(message_id)
+                    hint = input(f"送信元ドメインのヒント [{default_hint}]: ").strip() or default_hint
+                    for mailbox in ["INBOX"] + others:
+                        if not searcher.select_mailbox(mailbox):
+                            continue
+                        result = searcher.search_by_message_id_deep(message_id, hint or None)
+                        if result:
+                            result["mailbox"] = mailbox
+                            break
+                    searcher.select_mailbox("INBOX")
+                    if not result:
+                        print("❌ 深掘り検索でも見つかりませんでした")
                 if result:
                     print(f"\n✅ メールが見つかりました:")
+                    if "mailbox" in result:
+                        print(f"メールボックス: {result['mailbox']}")
+                    if result.get("labels"):
+                        print(f"ラベル: {', '.join(result['labels'])}")
                     print(f"件名: {result['subject']}")
                     print(f"送信者: {result['from']}")
                     print(f"日時: {result['date']}")
@@ -255,7 +1497,7 @@ def main():
 
             elif choice == "2":
                 sender = input("送信者のメールアドレス: ")
-                results = searcher.search_emails(f'FROM "{sender}"')
+                results = searcher.search_by_field("FROM", sender)
                 print(f"\n✅ {len(results)}件のメールが見つかりました:")
                 for i, email_info in enumerate(results, 1):
                     print(f"\n{i}. 件名: {email_info['subject']}")
@@ -263,7 +1505,7 @@ def main():
 
             elif choice == "3":
                 subject = input("検索する件名: ")
-                results = searcher.search_emails(f'SUBJECT "{subject}"')
+                results = searcher.search_by_field("SUBJECT", subject)
                 print(f"\n✅ {len(results)}件のメールが見つかりました:")
                 for i, email_info in enumerate(results, 1):
                     print(f"\n{i}. 件名: {email_info['subject']}")
@@ -277,6 +1519,44 @@ def main():
                     print(f"- {mailbox}")
 
             elif choice == "5":
+                message_ids = input("検索するメッセージID (空白またはカンマ区切り): ").replace(",", " ").split()
+                # 見つかった分からすぐに表示する
+                found = set()
+                for message_id, email_info in searcher.search_cached(message_ids).items():
+                    found.add(message_id)
+                    _print_found(message_id, email_info)
+                missing = [m for m in message_ids if m not in found]
+                if missing:
+                    for message_id, email_info in searcher.search_by_message_ids(missing).items():
+                        found.add(message_id)
+                        _print_found(message_id, email_info)
+                missing = [m for m in message_ids if m not in found]
+                if missing:
+                    for message_id, email_info in searcher.search_gmail(missing).items():
+                        found.add(message_id)
+                        _print_found(message_id, email_info)
+                missing = [m for m in message_ids if m not in found]
+                if missing:
+                    found_all = searcher.search_all_mailboxes(missing)
+                    if found_all is not None:
+                        for message_id, email_info in found_all.items():
+                            found.add(message_id)
+                            _print_found(message_id, email_info)
+                        missing = []  # サーバー側で全メールボックスを検索済み
+                others = []
+                if missing:
+                    others = searcher.skip_empty_mailboxes(searcher.scan_order())
+                if missing and others:
+                    print(f"\n🔎 残り {len(missing)} 件を他の {len(others)} 個のメールボックスで並列検索します...")
+                    for message_id, email_info in searcher.iter_message_ids_parallel(missing, others):
+                        found.add(message_id)
+                        _print_found(message_id, email_info)
+                print(f"\n✅ {len(found)}/{len(message_ids)} 件のメールが見つかりました")
+                for message_id in message_ids:
+                    if message_id not in found:
+                        print(f"- {message_id}: ❌ 見つかりませんでした")
+
+            elif choice == "6":
                 break
             else:
                 print("❌ 無効な選択です")